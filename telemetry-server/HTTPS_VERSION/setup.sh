@@ -21,7 +21,7 @@ apt-get install -y \
     curl
 
 # 2. Install Python packages
-pip3 install fastapi uvicorn pymavlink websockets
+pip3 install fastapi uvicorn pymavlink websockets orjson uvloop
 
 # 3. Install mkcert (for HTTPS)
 echo "Setting up mkcert..."
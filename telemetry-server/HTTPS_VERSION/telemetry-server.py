@@ -1,57 +1,102 @@
 import asyncio
-import json
 import logging
-from fastapi import FastAPI, WebSocket, WebSocketDisconnect
+import orjson
+import types
+from fastapi import FastAPI, WebSocket
 from pymavlink import mavutil
 import sys
+import threading
+import time
 from fastapi.responses import FileResponse
 import uvicorn
 from ssl import SSLContext, PROTOCOL_TLS_SERVER
 import ssl
 
+try:
+    import uvloop
+except ImportError:  # uvloop isn't available on every platform (e.g. Windows)
+    uvloop = None
+
 # Configure logging	
 logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s")
 
 # MAVLink connection settings
 MAVLINK_CONNECTION = "udp:127.0.0.1:14550"
 try:
-    logging.info(f"Connecting to MAVLink: {MAVLINK_CONNECTION}")
+    logging.info("Connecting to MAVLink: %s", MAVLINK_CONNECTION)
     mav_connection = mavutil.mavlink_connection(MAVLINK_CONNECTION, baud=57600)
     logging.info("MAVLink listener started on UDP:14550")
 except Exception as e:
-    logging.error(f"Failed to start MAVLink connection: {e}")
+    logging.error("Failed to start MAVLink connection: %s", e)
     sys.exit(1)
 
-telemetry_data = {}
+# Latest telemetry state. Only read_mavlink writes _state; everything else
+# reads it through the telemetry_data view or a copy taken for one broadcast.
+_state = {}
+telemetry_data = types.MappingProxyType(_state)
+BROADCAST_INTERVAL = 0.05  # seconds between WebSocket broadcasts
+BROADCAST_BATCH_SIZE = 50  # clients served before yielding to the event loop
+CLIENT_QUEUE_SIZE = 256  # frames buffered per client before the oldest is dropped
+MAVLINK_READ_BATCH = 16  # datagrams read per socket wakeup
 app = FastAPI()
 
 class ConnectionManager:
     def __init__(self):
-        self.active_connections = set()
+        self.active_connections = {}  # WebSocket -> outbound asyncio.Queue
+        self._writers = {}
+        self._queues = ()  # cached for broadcast, rebuilt only on connect/disconnect
 
     async def connect(self, websocket: WebSocket):
         await websocket.accept()
-        self.active_connections.add(websocket)
-        logging.info(f"New WebSocket connection: {websocket.client}")
+        queue = asyncio.Queue(maxsize=CLIENT_QUEUE_SIZE)
+        self.active_connections[websocket] = queue
+        self._writers[websocket] = asyncio.create_task(self._writer(websocket, queue))
+        self._queues = tuple(self.active_connections.values())
+        logging.debug("New WebSocket connection: %s", websocket.client)
 
     def disconnect(self, websocket: WebSocket):
         if websocket in self.active_connections:
-            self.active_connections.remove(websocket)
-            logging.info(f"WebSocket disconnected: {websocket.client}")
+            del self.active_connections[websocket]
+            self._queues = tuple(self.active_connections.values())
+            writer = self._writers.pop(websocket)
+            if writer is not asyncio.current_task():
+                writer.cancel()
+            logging.debug("WebSocket disconnected: %s", websocket.client)
 
-    async def broadcast(self, message: dict):
-        for connection in list(self.active_connections):
+    async def _writer(self, websocket: WebSocket, queue: asyncio.Queue):
+        # Drain one client's queue so a slow socket only delays itself
+        # Bind the ASGI send once and reuse one message dict for every frame,
+        # rather than having send_text build a new dict per send
+        send = websocket.send
+        message = {"type": "websocket.send", "text": None}
+        while True:
+            payload = await queue.get()
+            # Every frame is a full snapshot, so only the newest queued one needs sending
+            while not queue.empty():
+                payload = queue.get_nowait()
+            message["text"] = payload
             try:
-                await connection.send_json(message)
+                await send(message)
             except Exception as e:
-                logging.error(f"Error sending to WebSocket: {e}")
-                self.disconnect(connection)
+                logging.error("Error sending to WebSocket: %s", e)
+                self.disconnect(websocket)
+                return
+
+    async def broadcast(self, payload: str):
+        # Queue the same pre-encoded text frame for every client
+        for i, queue in enumerate(self._queues):
+            if i and i % BROADCAST_BATCH_SIZE == 0:
+                # Yield between batches so HTTP commands aren't starved by a large fanout
+                await asyncio.sleep(0)
+            if queue.full():
+                queue.get_nowait()  # Client is backed up; drop its oldest frame
+            queue.put_nowait(payload)
 
 manager = ConnectionManager()
 
 @app.get("/api/telemetry")
 async def get_latest_telemetry():
-    return telemetry_data
+    return telemetry_data.copy()
 
 @app.get("/")
 async def serve_index():
@@ -61,46 +106,125 @@ async def serve_index():
 async def websocket_endpoint(websocket: WebSocket):
     await manager.connect(websocket)
     try:
-        while True:
-            # Keep connection alive
-            await websocket.receive_text()
-    except WebSocketDisconnect:
-        manager.disconnect(websocket)
+        # Only the disconnect matters; raw receive() skips decoding client frames.
+        # Keepalive is handled by uvicorn's protocol-level ping (see run_server).
+        while (await websocket.receive())["type"] != "websocket.disconnect":
+            pass
     except Exception as e:
-        logging.error(f"WebSocket error: {e}")
+        logging.error("WebSocket error: %s", e)
+    finally:
         manager.disconnect(websocket)
 
-async def read_mavlink():
-    global telemetry_data
+def _enqueue_update(queue, batch):
+    try:
+        queue.put_nowait(batch)
+    except asyncio.QueueFull:
+        pass  # Consumer is behind; drop this batch, newer ones will follow
+
+# Unit conversions, precomputed so the handlers multiply instead of dividing
+INV_1E7 = 1e-7
+INV_1000 = 1e-3
+
+def _handle_position(msg, out):
+    out["lat"] = msg.lat * INV_1E7
+    out["lon"] = msg.lon * INV_1E7
+    out["alt"] = msg.alt * INV_1000
+
+def _handle_attitude(msg, out):
+    out["roll"] = msg.roll
+    out["pitch"] = msg.pitch
+    out["yaw"] = msg.yaw
+
+def _handle_battery(msg, out):
+    out["battery"] = msg.battery_remaining
+
+# MAVLink message type -> handler that fills a telemetry update from the message
+DISPATCH = {
+    "GLOBAL_POSITION_INT": _handle_position,
+    "ATTITUDE": _handle_attitude,
+    "BATTERY_STATUS": _handle_battery,
+}
+
+def _on_mavlink_readable(queue):
+    """Called by the event loop when the MAVLink UDP socket is readable.
+
+    Drains up to MAVLINK_READ_BATCH datagrams per wakeup and queues everything
+    they decode to as a single batch.
+    """
+    batch = []
+    for _ in range(MAVLINK_READ_BATCH):
+        try:
+            data = mav_connection.recv()  # also records the sender so commands can be sent back
+            if not data:
+                break  # socket drained
+            if mav_connection.first_byte:
+                mav_connection.auto_mavlink_version(data)
+            msgs = mav_connection.mav.parse_buffer(data)  # every message in the datagram in one call
+        except Exception as e:
+            logging.error("Error reading MAVLink data: %s", e)
+            break
+        if not msgs:
+            continue
+
+        for msg in msgs:
+            mav_connection.post_message(msg)  # keep pymavlink's per-connection state (modes, targets) current
+            handler = DISPATCH.get(msg.get_type())
+            if handler is None:
+                continue
+            update = {}
+            handler(msg, update)
+            batch.append(update)
+
+    if batch:
+        _enqueue_update(queue, batch)
+
+def _mavlink_reader_thread(loop, queue):
+    """Fallback for event loops without add_reader (e.g. the Proactor loop on Windows).
+
+    Blocks on the MAVLink connection in its own thread and hands each update to the loop.
+    """
     while True:
         try:
-            msg = await asyncio.get_event_loop().run_in_executor(
-                None,
-                lambda: mav_connection.recv_match(blocking=False)
-            )
-            
-            if msg:
-                if msg.get_type() == "GLOBAL_POSITION_INT":
-                    telemetry_data.update({
-                        "lat": msg.lat / 1e7,
-                        "lon": msg.lon / 1e7,
-                        "alt": msg.alt / 1000.0
-                    })
-                elif msg.get_type() == "ATTITUDE":
-                    telemetry_data.update({
-                        "roll": msg.roll,
-                        "pitch": msg.pitch,
-                        "yaw": msg.yaw
-                    })
-                elif msg.get_type() == "BATTERY_STATUS":
-                    telemetry_data["battery"] = msg.battery_remaining
-
-                await manager.broadcast(telemetry_data)
-        
+            msg = mav_connection.recv_match(blocking=True, timeout=1.0)
         except Exception as e:
-            logging.error(f"Error reading MAVLink data: {e}")
-        
-        await asyncio.sleep(0.1)
+            logging.error("MAVLink read error: %s", e)
+            time.sleep(2)  # Avoid hammering the log in case of rapid errors
+            continue
+        if msg is None:
+            continue
+        handler = DISPATCH.get(msg.get_type())
+        if handler is None:
+            continue
+        update = {}
+        handler(msg, update)
+        loop.call_soon_threadsafe(_enqueue_update, queue, [update])
+
+async def read_mavlink():
+    loop = asyncio.get_running_loop()
+    mav_queue = asyncio.Queue(maxsize=1024)
+    # pymavlink's UDP socket is already non-blocking, so the event loop can watch it directly
+    fd = mav_connection.port.fileno()
+    try:
+        loop.add_reader(fd, _on_mavlink_readable, mav_queue)
+    except NotImplementedError:
+        fd = None
+        threading.Thread(target=_mavlink_reader_thread, args=(loop, mav_queue), name="mavlink-reader", daemon=True).start()
+    try:
+        while True:
+            batch = await mav_queue.get()
+            for update in batch:
+                _state.update(update)
+    finally:
+        if fd is not None:
+            loop.remove_reader(fd)
+
+async def broadcaster():
+    """Send the latest telemetry state to all clients at a fixed rate."""
+    while True:
+        await asyncio.sleep(BROADCAST_INTERVAL)
+        # Copy once so the encoder never sees the dict change under it, then encode once for all clients
+        snapshot = _state.copy()
+        await manager.broadcast(orjson.dumps(snapshot).decode())
 
 async def run_server():
     # SSL configuration
@@ -114,6 +238,8 @@ async def run_server():
         log_level="info",
         ssl_certfile="certs/localhost+3.pem",
         ssl_keyfile="certs/localhost+3-key.pem",
+        ws_ping_interval=20.0,
+        ws_ping_timeout=20.0,
     )
     server = uvicorn.Server(config)
     await server.serve()
@@ -122,7 +248,8 @@ async def main():
     try:
         await asyncio.gather(
             run_server(),
-            read_mavlink()
+            read_mavlink(),
+            broadcaster()
         )
     except KeyboardInterrupt:
         logging.info("Server shutting down...")
@@ -136,4 +263,11 @@ async def main():
         manager.active_connections.clear()
 
 if __name__ == "__main__":
-    asyncio.run(main())
+    if uvloop is None:
+        asyncio.run(main())
+    elif sys.version_info >= (3, 12):
+        # uvloop.install() is deprecated from 3.12; hand asyncio.run the loop factory instead
+        asyncio.run(main(), loop_factory=uvloop.new_event_loop)
+    else:
+        uvloop.install()
+        asyncio.run(main())
@@ -1,73 +1,185 @@
 import asyncio
+import math
 import time
-from collections import deque
-from typing import Dict, Any, Set
+from array import array
+from typing import Dict, Any, List, Optional, Tuple
+import orjson
 from gcp_publisher import publish_telem
 import logging
 
+BROADCAST_BATCH_SIZE = 50  # listeners served before yielding to the event loop
+LISTENER_QUEUE_SIZE = 256  # frames buffered per listener before the oldest is dropped
+CLOUD_QUEUE_SIZE = 128  # cloud payloads waiting for the publisher before new ones are dropped
+
+# Fields kept in the history ring buffer for each parsed message type
+HISTORY_FIELDS = {
+    "position": ("lat", "lon", "alt"),
+    "attitude": ("roll", "pitch", "yaw"),
+    "battery": ("battery_remaining",),
+}
+_HISTORY_TYPES = tuple(HISTORY_FIELDS)
+_HISTORY_TYPE_INDEX = {name: i for i, name in enumerate(_HISTORY_TYPES)}
+_INTEGER_FIELDS = {"battery_remaining"}
+
+# DataHandler state is only touched from the event loop thread, and no update
+# awaits part-way through, so coroutines can't interleave and no lock is needed.
 class DataHandler:
     def __init__(self, history_size: int = 1000, emit_interval: float = 0.5):
         self.snapshot: Dict[str, Any] = {}
-        self.history = deque(maxlen=history_size)
-        self.listeners: Set = set()
+        if history_size < 0:
+            raise ValueError("history_size must be >= 0")
+        # History is a fixed-size ring buffer stored column-wise (one array per field)
+        self.history_size = history_size
+        self._hist_ts = array("d", bytes(8 * history_size))
+        self._hist_type = array("b", bytes(history_size))
+        self._hist_cols = {
+            name: array("d", bytes(8 * history_size))
+            for fields in HISTORY_FIELDS.values() for name in fields
+        }
+        self._hist_head = 0
+        self._hist_count = 0
+        self.listeners: Dict[Any, asyncio.Queue] = {}
+        self._writers: Dict[Any, asyncio.Task] = {}
+        self._queues: Tuple[asyncio.Queue, ...] = ()  # cached for broadcast, rebuilt only on (un)register
         self.emit_interval = emit_interval
-        self._lock = asyncio.Lock()
-        self._last_emit = 0.0
+        # Created in start(): on Python < 3.10 a Queue binds to the loop current at construction
+        self._cloud_q: Optional[asyncio.Queue] = None
+        self._broadcast_task = None
+        self._cloud_task = None
+
+    def start(self):
+        """Start the background broadcaster and cloud publisher. Must be called from within the running event loop."""
+        if self._broadcast_task is None:
+            self._broadcast_task = asyncio.create_task(self._broadcast_loop())
+        if self._cloud_q is None:
+            self._cloud_q = asyncio.Queue(maxsize=CLOUD_QUEUE_SIZE)
+        if self._cloud_task is None:
+            self._cloud_task = asyncio.create_task(self._cloud_worker())
 
     async def register_listener(self, ws):
-        async with self._lock:
-            self.listeners.add(ws)
+        queue = asyncio.Queue(maxsize=LISTENER_QUEUE_SIZE)
+        self.listeners[ws] = queue
+        self._writers[ws] = asyncio.create_task(self._writer(ws, queue))
+        self._queues = tuple(self.listeners.values())
 
     async def unregister_listener(self, ws):
-        async with self._lock:
-            self.listeners.discard(ws)
+        if self.listeners.pop(ws, None) is not None:
+            self._queues = tuple(self.listeners.values())
+        writer = self._writers.pop(ws, None)
+        if writer is not None and writer is not asyncio.current_task():
+            writer.cancel()
+
+    async def _writer(self, ws, queue: asyncio.Queue):
+        """Drain one listener's queue so a slow socket only delays itself."""
+        # Bind the ASGI send once and reuse one message dict for every frame,
+        # rather than having send_text build a new dict per send
+        send = ws.send
+        message = {"type": "websocket.send", "text": None}
+        while True:
+            payload = await queue.get()
+            # Every frame is a full snapshot, so only the newest queued one needs sending
+            while not queue.empty():
+                payload = queue.get_nowait()
+            message["text"] = payload
+            try:
+                await send(message)
+            except Exception:
+                await self.unregister_listener(ws)
+                return
 
     async def process_parsed_message(self, data: dict):
-        async with self._lock:
-            entry = {"ts": time.time(), **data}
-            self.history.append(entry)
+        await self.process_parsed_batch([data])
+
+    async def process_parsed_batch(self, msgs: List[dict]):
+        """Apply a batch of parsed messages to history and the snapshot."""
+        now = time.time()
+        for data in msgs:
+            self._record_history(now, data)
             msg_type = data.get("type")
             if msg_type:
                 self.snapshot[msg_type] = {k: v for k, v in data.items() if k != "type"}
 
-        await self._maybe_broadcast()
-        await self._maybe_publish_cloud()
-
-    async def _maybe_broadcast(self):
-        now = time.time()
-        if now - self._last_emit < self.emit_interval:
-            return
-        self._last_emit = now
+        self._maybe_publish_cloud()
 
-        async with self._lock:
-            snapshot_copy = {"ts": time.time(), **self.snapshot}
-            listeners = list(self.listeners)
+    def _record_history(self, ts: float, data: dict):
+        """Write one message into the ring buffer. Types without HISTORY_FIELDS are not kept."""
+        msg_type = data.get("type")
+        fields = HISTORY_FIELDS.get(msg_type)
+        if fields is None or not self.history_size:
+            return  # history_size=0 keeps nothing, like the old deque(maxlen=0)
+        i = self._hist_head
+        self._hist_ts[i] = ts
+        self._hist_type[i] = _HISTORY_TYPE_INDEX[msg_type]
+        for name in fields:
+            value = data.get(name)
+            self._hist_cols[name][i] = math.nan if value is None else value
+        self._hist_head = (i + 1) % self.history_size
+        if self._hist_count < self.history_size:
+            self._hist_count += 1
 
-        for ws in listeners:
+    async def _broadcast_loop(self):
+        """Push the latest snapshot to all listeners once every emit_interval."""
+        while True:
+            await asyncio.sleep(self.emit_interval)
             try:
-                await ws.send_json(snapshot_copy)
-            except Exception:
-                async with self._lock:
-                    self.listeners.discard(ws)
+                await self._broadcast()
+            except Exception as e:
+                logging.error("Broadcast error: %s", e)
 
-    async def _maybe_publish_cloud(self):
-        """Send aggregated snapshot to Pub/Sub periodically."""
+    async def _broadcast(self):
+        snapshot_copy = {"ts": time.time(), **self.snapshot}
+        payload = orjson.dumps(snapshot_copy).decode()
+        for i, queue in enumerate(self._queues):
+            if i and i % BROADCAST_BATCH_SIZE == 0:
+                # Yield between batches so HTTP commands aren't starved by a large fanout
+                await asyncio.sleep(0)
+            if queue.full():
+                queue.get_nowait()  # Listener is backed up; drop its oldest frame
+            queue.put_nowait(payload)
+
+    def _maybe_publish_cloud(self):
+        """Queue the aggregated snapshot for the cloud worker; dropped if the worker is behind."""
+        if self._cloud_q is None:
+            return  # start() hasn't run yet, so there is no worker to hand it to
+        cloud_payload = {
+            "droneId": "drone123",
+            **self.snapshot.get("position", {}),
+            **self.snapshot.get("attitude", {}),
+            **self.snapshot.get("battery", {}),
+            "timestamp": time.time()
+        }
         try:
-            cloud_payload = {
-                "droneId": "drone123",
-                **self.snapshot.get("position", {}),
-                **self.snapshot.get("attitude", {}),
-                **self.snapshot.get("battery", {}),
-                "timestamp": time.time()
-            }
-            asyncio.create_task(publish_telem(cloud_payload))
-        except Exception as e:
-            logging.error(f"GCP publish error: {e}")
+            self._cloud_q.put_nowait(cloud_payload)
+        except asyncio.QueueFull:
+            pass
+
+    async def _cloud_worker(self):
+        """Single long-lived task that forwards queued snapshots to Pub/Sub."""
+        while True:
+            cloud_payload = await self._cloud_q.get()
+            try:
+                await publish_telem(cloud_payload)
+            except Exception as e:
+                logging.error("GCP publish error: %s", e)
 
     async def get_snapshot(self):
-        async with self._lock:
-            return {"ts": time.time(), **self.snapshot}
+        return {"ts": time.time(), **self.snapshot}
 
     async def get_history(self, limit: int = 100):
-        async with self._lock:
-            return list(self.history)[-limit:]
+        # Same semantics as the old list(history)[-limit:], including limit <= 0
+        count = len(range(self._hist_count)[-limit:])
+        start = self._hist_head - count
+        entries = []
+        for j in range(start, start + count):
+            i = j % self.history_size
+            msg_type = _HISTORY_TYPES[self._hist_type[i]]
+            entry = {"ts": self._hist_ts[i], "type": msg_type}
+            for name in HISTORY_FIELDS[msg_type]:
+                value = self._hist_cols[name][i]
+                if math.isnan(value):
+                    value = None
+                elif name in _INTEGER_FIELDS:
+                    value = int(value)
+                entry[name] = value
+            entries.append(entry)
+        return entries
@@ -1,29 +1,40 @@
 from google.cloud import pubsub_v1
-import asyncio
-import json
 import logging
+import orjson
 import os
 
 # Edit these with actual GCP credentials (create an .env file if possible with these secrets)
 PROJECT_ID = os.getenv("GCP_PROJECT_ID", "YOUR_PROJECT_ID")
 TOPIC_ID = os.getenv("GCP_TOPIC_ID", "drone-telemetry")
 
+# Let the client library group messages into one request instead of one per publish
+BATCH_SETTINGS = pubsub_v1.types.BatchSettings(
+    max_messages=100,
+    max_latency=0.5,  # seconds
+    max_bytes=1024 * 1024,
+)
+
 try:
-    publisher = pubsub_v1.PublisherClient()
+    publisher = pubsub_v1.PublisherClient(batch_settings=BATCH_SETTINGS)
     topic_path = publisher.topic_path(PROJECT_ID, TOPIC_ID)
 except Exception as e:
-    logging.error(f"Error initializing Pub/Sub client: {e}")
+    logging.error("Error initializing Pub/Sub client: %s", e)
     publisher = None
     topic_path = None
 
+def _on_publish_done(future):
+    try:
+        future.result()
+    except Exception as e:
+        logging.error("Failed to publish telemetry: %s", e)
+
 async def publish_telem(data: dict):
-    """Publish telemetry data to Pub/Sub asynchronously."""
+    """Queue telemetry data for a batched Pub/Sub publish. Does not wait for the server ack."""
     if not publisher or not topic_path:
         return
     try:
-        payload = json.dumps(data).encode("utf-8")
+        payload = orjson.dumps(data)
         future = publisher.publish(topic_path, payload)
-        await asyncio.wrap_future(future)
-        logging.info(f"Published telemetry to Pub/Sub topic: {TOPIC_ID}")
+        future.add_done_callback(_on_publish_done)
     except Exception as e:
-        logging.error(f"Failed to publish telemetry: {e}")
+        logging.error("Failed to publish telemetry: %s", e)
@@ -15,7 +15,7 @@ apt-get update
 apt-get install -y python3-pip
 
 # 2. Install Python packages
-pip3 install fastapi uvicorn pymavlink websockets
+pip3 install fastapi uvicorn pymavlink websockets orjson uvloop
 
 # 3. Firewall permission (if ufw is active)
 if command -v ufw &> /dev/null; then
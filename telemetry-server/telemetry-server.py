@@ -1,12 +1,18 @@
 import asyncio
 import logging
-import math
 import sys
-from fastapi import FastAPI, WebSocket, WebSocketDisconnect
+import threading
+import time
+from fastapi import FastAPI, WebSocket
 from fastapi.responses import FileResponse
 from pymavlink import mavutil
 import uvicorn
 
+try:
+    import uvloop
+except ImportError:  # uvloop isn't available on every platform (e.g. Windows)
+    uvloop = None
+
 from data_handler import DataHandler
 
 # Configure logging
@@ -15,16 +21,17 @@ logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s - %(
 # MAVLink connection settings
 # Connect to MAVProxy's GCS port for two-way communication
 MAVLINK_CONNECTION = "udp:127.0.0.1:14550"
+MAVLINK_READ_BATCH = 16  # datagrams read per socket wakeup
 try:
-    logging.info(f"Connecting to MAVLink: {MAVLINK_CONNECTION}")
+    logging.info("Connecting to MAVLink: %s", MAVLINK_CONNECTION)
     mav_connection = mavutil.mavlink_connection(MAVLINK_CONNECTION)
     
     # Wait for the first heartbeat to confirm connection
     mav_connection.wait_heartbeat()
-    logging.info(f"Heartbeat from system (system {mav_connection.target_system} component {mav_connection.target_component})")
+    logging.info("Heartbeat from system (system %s component %s)", mav_connection.target_system, mav_connection.target_component)
     
 except Exception as e:
-    logging.error(f"Failed to start MAVLink connection: {e}")
+    logging.error("Failed to start MAVLink connection: %s", e)
     sys.exit(1)
 
 # FastAPI setup
@@ -54,9 +61,9 @@ def disarm_vehicle():
 def set_mode(mode_name):
     mode_id = mav_connection.mode_mapping().get(mode_name)
     if mode_id is None:
-        logging.error(f"Unknown mode: {mode_name}")
+        logging.error("Unknown mode: %s", mode_name)
         return
-    logging.info(f"Setting mode: {mode_name}")
+    logging.info("Setting mode: %s", mode_name)
     mav_connection.mav.set_mode_send(
         mav_connection.target_system,
         mavutil.mavlink.MAV_MODE_FLAG_CUSTOM_MODE_ENABLED,
@@ -64,7 +71,7 @@ def set_mode(mode_name):
     )
 
 def takeoff(altitude):
-    logging.info(f"Takeoff to {altitude} meters")
+    logging.info("Takeoff to %s meters", altitude)
     mav_connection.mav.command_long_send(
         mav_connection.target_system,
         mav_connection.target_component,
@@ -114,55 +121,139 @@ async def telemetry_ws(websocket: WebSocket):
     await websocket.accept()
     await data_handler.register_listener(websocket)
     try:
-        while True:
-            await websocket.receive_text()
-    except WebSocketDisconnect:
+        # Only the disconnect matters; raw receive() skips decoding client frames.
+        # Keepalive is handled by uvicorn's protocol-level ping (see run_server).
+        while (await websocket.receive())["type"] != "websocket.disconnect":
+            pass
+    finally:
         await data_handler.unregister_listener(websocket)
 
 # --- MAVLink Reading Loop ---
-async def read_mavlink():
-    while True:
+def _enqueue_parsed(queue, batch):
+    try:
+        queue.put_nowait(batch)
+    except asyncio.QueueFull:
+        pass  # Consumer is behind; drop this batch, newer ones will follow
+
+# Unit conversions, precomputed so the handlers multiply instead of dividing or calling math.degrees
+DEG = 57.29577951308232  # 180 / pi
+INV_1E7 = 1e-7
+INV_1000 = 1e-3
+
+def _handle_position(msg, out):
+    out["type"] = "position"
+    out["lat"] = msg.lat * INV_1E7
+    out["lon"] = msg.lon * INV_1E7
+    out["alt"] = msg.alt * INV_1000
+
+def _handle_attitude(msg, out):
+    out["type"] = "attitude"
+    out["roll"] = msg.roll * DEG
+    out["pitch"] = msg.pitch * DEG
+    out["yaw"] = msg.yaw * DEG
+
+def _handle_battery(msg, out):
+    out["type"] = "battery"
+    out["battery_remaining"] = getattr(msg, "battery_remaining", None)
+
+# MAVLink message type -> handler that fills a parsed dict from the message
+DISPATCH = {
+    "GLOBAL_POSITION_INT": _handle_position,
+    "ATTITUDE": _handle_attitude,
+    "BATTERY_STATUS": _handle_battery,
+}
+
+def _on_mavlink_readable(queue):
+    """Called by the event loop when the MAVLink UDP socket is readable.
+
+    Drains up to MAVLINK_READ_BATCH datagrams per wakeup and queues everything
+    they decode to as a single batch.
+    """
+    batch = []
+    for _ in range(MAVLINK_READ_BATCH):
         try:
-            msg = await asyncio.get_event_loop().run_in_executor(None, lambda: mav_connection.recv_match(blocking=True, timeout=0.05))
-            if not msg:
-                await asyncio.sleep(0.01)
+            data = mav_connection.recv()  # also records the sender so commands can be sent back
+            if not data:
+                break  # socket drained
+            if mav_connection.first_byte:
+                mav_connection.auto_mavlink_version(data)
+            msgs = mav_connection.mav.parse_buffer(data)  # every message in the datagram in one call
+        except Exception as e:
+            logging.error("MAVLink read error: %s", e)
+            break
+        if not msgs:
+            continue
+
+        for msg in msgs:
+            mav_connection.post_message(msg)  # keep pymavlink's per-connection state (modes, targets) current
+            handler = DISPATCH.get(msg.get_type())
+            if handler is None:
                 continue
+            parsed = {}
+            handler(msg, parsed)
+            batch.append(parsed)
 
-            parsed = None
-            msg_type = msg.get_type()
-
-            if msg_type == "GLOBAL_POSITION_INT":
-                parsed = {
-                    "type": "position",
-                    "lat": msg.lat / 1e7,
-                    "lon": msg.lon / 1e7,
-                    "alt": msg.alt / 1000.0
-                }
-            elif msg_type == "ATTITUDE":
-                parsed = {
-                    "type": "attitude",
-                    "roll": math.degrees(msg.roll),
-                    "pitch": math.degrees(msg.pitch),
-                    "yaw": math.degrees(msg.yaw)
-                }
-            elif msg_type == "BATTERY_STATUS":
-                parsed = {"type": "battery", "battery_remaining": getattr(msg, "battery_remaining", None)}
-
-            if parsed:
-                await data_handler.process_parsed_message(parsed)
+    if batch:
+        _enqueue_parsed(queue, batch)
 
+def _mavlink_reader_thread(loop, queue):
+    """Fallback for event loops without add_reader (e.g. the Proactor loop on Windows).
+
+    Blocks on the MAVLink connection in its own thread and hands each update to the loop.
+    """
+    while True:
+        try:
+            msg = mav_connection.recv_match(blocking=True, timeout=1.0)
         except Exception as e:
-            logging.error(f"MAVLink read error: {e}")
-        await asyncio.sleep(0.01)
+            logging.error("MAVLink read error: %s", e)
+            time.sleep(2)  # Avoid hammering the log in case of rapid errors
+            continue
+        if msg is None:
+            continue
+        handler = DISPATCH.get(msg.get_type())
+        if handler is None:
+            continue
+        parsed = {}
+        handler(msg, parsed)
+        loop.call_soon_threadsafe(_enqueue_parsed, queue, [parsed])
+
+async def read_mavlink():
+    loop = asyncio.get_running_loop()
+    mav_queue = asyncio.Queue(maxsize=1024)
+    # pymavlink's UDP socket is already non-blocking, so the event loop can watch it directly
+    fd = mav_connection.port.fileno()
+    try:
+        loop.add_reader(fd, _on_mavlink_readable, mav_queue)
+    except NotImplementedError:
+        fd = None
+        threading.Thread(target=_mavlink_reader_thread, args=(loop, mav_queue), name="mavlink-reader", daemon=True).start()
+    try:
+        while True:
+            batch = await mav_queue.get()
+            try:
+                await data_handler.process_parsed_batch(batch)
+            except Exception as e:
+                logging.error("Telemetry processing error: %s", e)
+    finally:
+        if fd is not None:
+            loop.remove_reader(fd)
 
 # --- Main Application Runner  ---
 async def run_server():
-    config = uvicorn.Config(app, host="0.0.0.0", port=8000, log_level="info")
+    config = uvicorn.Config(app, host="0.0.0.0", port=8000, log_level="info", ws_ping_interval=20.0, ws_ping_timeout=20.0)
     server = uvicorn.Server(config)
     await server.serve()
 
 async def main():
+    data_handler.start()
     await asyncio.gather(run_server(), read_mavlink())
 
 if __name__ == "__main__":
-    asyncio.run(main())
+    if uvloop is None:
+        asyncio.run(main())
+    elif sys.version_info >= (3, 12):
+        # uvloop.install() is deprecated from 3.12; hand asyncio.run the loop factory instead
+        asyncio.run(main(), loop_factory=uvloop.new_event_loop)
+    else:
+        uvloop.install()
+        asyncio.run(main())
@@ -1,12 +1,14 @@
 import asyncio
-import json
 import logging
 import math
+import msgspec
 import sys
 import random
+import threading
 import time
+from typing import Optional
 from fastapi import FastAPI, WebSocket, WebSocketDisconnect
-from fastapi.responses import JSONResponse
+from fastapi.responses import Response
 from pymavlink import mavutil
 import uvicorn
 
@@ -24,15 +26,24 @@ USE_DUMMY_DATA = True
 MAVLINK_CONNECTION_STRING = "udp:127.0.0.1:14557"
 MAVLINK_BAUD_RATE = 57600 # Standard for many radios, ignored for UDP
 
+# --- WebSocket Settings ---
+CLIENT_QUEUE_SIZE = 8 # Frames buffered per client before the oldest is dropped
+BROADCAST_INTERVAL = 0.02 # Seconds between flushes; caps broadcasts at 50 Hz
+MAVLINK_READ_BATCH = 16 # Max UDP datagrams drained per socket wakeup
+
 # --- MAVLink Connection ---
 # Global variable to hold the connection
 mav_connection = None
+# Set on shutdown to stop the MAVLink reader thread
+mav_reader_stop = threading.Event()
+# Socket the event loop is watching for UDP connections, so shutdown can unregister it
+mav_reader_fd = None
 
 def connect_to_mavlink():
     """Initializes the MAVLink connection."""
     global mav_connection
     try:
-        logging.info(f"Attempting to connect to MAVLink: {MAVLINK_CONNECTION_STRING}")
+        logging.info("Attempting to connect to MAVLink: %s", MAVLINK_CONNECTION_STRING)
         mav_connection = mavutil.mavlink_connection(MAVLINK_CONNECTION_STRING, baud=MAVLINK_BAUD_RATE)
         
         # Wait for the first heartbeat to confirm the connection
@@ -40,7 +51,7 @@ def connect_to_mavlink():
         logging.info("MAVLink connection established! Heartbeat received.")
         
     except Exception as e:
-        logging.error(f"Failed to connect to MAVLink: {e}")
+        logging.error("Failed to connect to MAVLink: %s", e)
         logging.error("Please check the connection string, baud rate, and ensure the drone/simulator is running.")
         sys.exit(1)
 
@@ -51,50 +62,124 @@ app = FastAPI(
     version="1.0.0"
 )
 
-# Global dictionary to store the latest telemetry state
+# --- Telemetry State ---
+# Typed structs let msgspec build a specialized encoder for this exact shape.
+# Field order and defaults match the JSON clients already receive.
+class Location(msgspec.Struct):
+    lat: Optional[float] = None
+    lon: Optional[float] = None
+    alt: Optional[float] = None
+
+class Attitude(msgspec.Struct):
+    roll: Optional[float] = None
+    pitch: Optional[float] = None
+    yaw: Optional[float] = None
+
+class Battery(msgspec.Struct):
+    voltage: Optional[float] = None
+    current: Optional[float] = None
+    remaining: Optional[int] = None
+
+class GpsStatus(msgspec.Struct):
+    fix_type: Optional[int] = None
+    satellites_visible: Optional[int] = None
+
+class Telemetry(msgspec.Struct):
+    location: Location = msgspec.field(default_factory=Location)
+    attitude: Attitude = msgspec.field(default_factory=Attitude)
+    battery: Battery = msgspec.field(default_factory=Battery)
+    gps_status: GpsStatus = msgspec.field(default_factory=GpsStatus)
+    armed: bool = False
+    mode: str = "UNKNOWN"
+
+# Global object holding the latest telemetry state
 # We initialize it with default values to ensure the structure is always predictable
-telemetry_data = {
-    "location": {"lat": None, "lon": None, "alt": None},
-    "attitude": {"roll": None, "pitch": None, "yaw": None},
-    "battery": {"voltage": None, "current": None, "remaining": None},
-    "gps_status": {"fix_type": None, "satellites_visible": None},
-    "armed": False,
-    "mode": "UNKNOWN"
-}
+telemetry_data = Telemetry()
+
+# Latest published telemetry as one immutable (payload, ws_message) pair: the JSON bytes
+# for the REST endpoint and a ready-made ASGI text frame for WebSocket clients.
+# Producers change telemetry_data and call _mark_dirty(); flush_telemetry() re-encodes at
+# most once per tick and swaps the whole pair in a single assignment, so every reader
+# sees a consistent encoding without locks or per-request serialization.
+_dirty = False
+# One encoder reused for every snapshot rather than going through msgspec.json.encode
+_encoder = msgspec.json.Encoder()
+
+def _encode_snapshot() -> tuple[bytes, dict]:
+    payload = _encoder.encode(telemetry_data)
+    return payload, {"type": "websocket.send", "text": payload.decode()}
+
+_snapshot = _encode_snapshot()
+
+def _mark_dirty():
+    global _dirty
+    _dirty = True
 
 class ConnectionManager:
     """Manages active WebSocket connections."""
     def __init__(self):
-        self.active_connections: set[WebSocket] = set()
+        # Each client gets a bounded outbound queue drained by its own writer task,
+        # so one slow client can't hold up the broadcast for everyone else
+        self.active_connections: dict[WebSocket, asyncio.Queue] = {}
+        self._writers: dict[WebSocket, asyncio.Task] = {}
 
     async def connect(self, websocket: WebSocket):
         await websocket.accept()
-        self.active_connections.add(websocket)
-        logging.info(f"New client connected: {websocket.client}")
+        queue = asyncio.Queue(maxsize=CLIENT_QUEUE_SIZE)
+        self.active_connections[websocket] = queue
+        self._writers[websocket] = asyncio.create_task(self._writer(websocket, queue))
+        logging.debug("New client connected: %s", websocket.client)
 
     def disconnect(self, websocket: WebSocket):
-        if websocket in self.active_connections:
-            self.active_connections.remove(websocket)
-            logging.info(f"Client disconnected: {websocket.client}")
-
-    async def broadcast_json(self, data: dict):
-        """Broadcasts data as JSON to all connected clients."""
-        for connection in list(self.active_connections):
+        if self.active_connections.pop(websocket, None) is not None:
+            writer = self._writers.pop(websocket)
+            if writer is not asyncio.current_task():
+                writer.cancel()
+            logging.debug("Client disconnected: %s", websocket.client)
+
+    async def _writer(self, websocket: WebSocket, queue: asyncio.Queue):
+        """Sends queued frames to one client until it disconnects."""
+        # Queued items are ready-made ASGI messages, so go straight to the raw send
+        send = websocket.send
+        while True:
+            message = await queue.get()
             try:
-                await connection.send_json(data)
+                await send(message)
             except WebSocketDisconnect:
-                self.disconnect(connection)
+                self.disconnect(websocket)
+                return
             except Exception as e:
-                logging.error(f"Error broadcasting to client {connection.client}: {e}")
-                self.disconnect(connection)
+                logging.error("Error broadcasting to client %s: %s", websocket.client, e)
+                self.disconnect(websocket)
+                return
+
+    def send_message(self, websocket: WebSocket, message: dict):
+        """Queues a ready-made ASGI send message for a single client."""
+        queue = self.active_connections.get(websocket)
+        if queue is not None:
+            self._enqueue(queue, message)
+
+    async def broadcast_message(self, message: dict):
+        """Queues one ready-made ASGI send message for all connected clients."""
+        # The same message goes to every client; the server only reads it, so sharing is safe
+        enqueue = self._enqueue
+        for queue in self.active_connections.values():
+            enqueue(queue, message)
+
+    @staticmethod
+    def _enqueue(queue: asyncio.Queue, message: dict):
+        if queue.full():
+            queue.get_nowait()  # Client is backed up; drop its oldest frame
+        queue.put_nowait(message)
 
 manager = ConnectionManager()
 
 # --- API Endpoints ---
-@app.get("/api/v1/telemetry", response_class=JSONResponse)
+@app.get("/api/v1/telemetry")
 async def get_latest_telemetry():
     """Returns the latest snapshot of all telemetry data as a JSON object."""
-    return telemetry_data
+    # The snapshot is already JSON, so hand it back as-is with no re-encoding
+    return Response(content=_snapshot[0], media_type="application/json")
 
 @app.websocket("/ws/v1/telemetry")
 async def websocket_telemetry_endpoint(websocket: WebSocket):
@@ -105,14 +190,13 @@ async def websocket_telemetry_endpoint(websocket: WebSocket):
     await manager.connect(websocket)
     try:
         # Send the current state immediately on connection
-        await websocket.send_json(telemetry_data)
-        # Keep the connection alive
-        while True:
-            await websocket.receive_text()
-    except WebSocketDisconnect:
-        manager.disconnect(websocket)
+        manager.send_message(websocket, _snapshot[1])
+        # Only the disconnect matters; raw receive() skips decoding client frames
+        while (await websocket.receive())["type"] != "websocket.disconnect":
+            pass
     except Exception as e:
-        logging.error(f"WebSocket error: {e}")
+        logging.error("WebSocket error: %s", e)
+    finally:
         manager.disconnect(websocket)
 
 # --- Dummy Data Generator ---
@@ -121,7 +205,6 @@ async def generate_and_broadcast_dummy_data():
     Generates simulated drone telemetry and broadcasts it.
     This runs instead of the MAVLink reader when USE_DUMMY_DATA is True.
     """
-    global telemetry_data
     logging.info("Starting dummy data generator.")
     
     # Starting point (Atlanta, GA)
@@ -129,114 +212,220 @@ async def generate_and_broadcast_dummy_data():
     alt = 0
     yaw = 0
 
+    # Update the existing nested structs in place rather than rebuilding them every tick
+    location = telemetry_data.location
+    attitude = telemetry_data.attitude
+    battery = telemetry_data.battery
+    gps_status = telemetry_data.gps_status
+    gps_status.fix_type = 6 # Corresponds to RTK Fixed
+    telemetry_data.armed = True
+    telemetry_data.mode = "GUIDED"
+
+    # Monotonic so the simulated battery drain can't jump on a wall-clock/NTP adjustment
+    monotonic = time.monotonic
+    start = monotonic()
+    # One bound C call per sample instead of going through random.uniform/randint
+    _rand = random.random
+
     while True:
         # Simulate movement
-        lat += random.uniform(-0.00005, 0.00005)
-        lon += random.uniform(-0.00005, 0.00005)
-        alt += random.uniform(-0.5, 0.5)
+        lat += (_rand()*2 - 1)*0.00005
+        lon += (_rand()*2 - 1)*0.00005
+        alt += _rand() - 0.5
         if alt < 0: alt = 0 # Don't go underground
         
-        yaw = (yaw + random.uniform(-2, 2)) % 360
-
-        telemetry_data = {
-            "location": {
-                "lat": lat,
-                "lon": lon,
-                "alt": max(0, alt) # Ensure altitude is not negative
-            },
-            "attitude": {
-                "roll": random.uniform(-5.0, 5.0),
-                "pitch": random.uniform(-5.0, 5.0),
-                "yaw": yaw
-            },
-            "battery": {
-                "voltage": round(random.uniform(11.8, 12.6), 2),
-                "current": round(random.uniform(7.0, 15.0), 2),
-                "remaining": int(90 - (time.time() % 600) / 10) # Decrease over 10 mins
-            },
-            "gps_status": {
-                "fix_type": 6, # Corresponds to RTK Fixed
-                "satellites_visible": random.randint(10, 15)
-            },
-            "armed": True,
-            "mode": "GUIDED"
-        }
-
-        await manager.broadcast_json(telemetry_data)
-        await asyncio.sleep(0.5) # Broadcast twice per second
+        yaw = (yaw + (_rand()*2 - 1)*2) % 360
+
+        location.lat = lat
+        location.lon = lon
+        location.alt = max(0, alt) # Ensure altitude is not negative
+        attitude.roll = (_rand()*2 - 1)*5.0
+        attitude.pitch = (_rand()*2 - 1)*5.0
+        attitude.yaw = yaw
+        battery.voltage = round(11.8 + _rand()*0.8, 2)
+        battery.current = round(7.0 + _rand()*8.0, 2)
+        battery.remaining = 90 - int((monotonic() - start) % 600 / 10) # Decrease over 10 mins
+        gps_status.satellites_visible = 10 + int(_rand()*6)
+        _mark_dirty()
+
+        await asyncio.sleep(0.5) # Update twice per second
 
 
 # --- Background MAVLink Reader Task ---
+# Everything the handlers touch is bound once here so each message costs
+# global lookups instead of module/attribute chains
+_ARMED_FLAG = mavutil.mavlink.MAV_MODE_FLAG_SAFETY_ARMED
+_RAD2DEG = 180.0 / math.pi # plain multiply instead of a math.degrees call per axis
+_mode_str = mavutil.mode_string_v10
+_td_loc = telemetry_data.location
+_td_att = telemetry_data.attitude
+_td_bat = telemetry_data.battery
+_td_gps = telemetry_data.gps_status
+
+def _h_gpi(msg):
+    _td_loc.lat = msg.lat / 1e7
+    _td_loc.lon = msg.lon / 1e7
+    _td_loc.alt = msg.relative_alt / 1000.0 # More common to use relative alt
+
+def _h_att(msg):
+    _td_att.roll = msg.roll * _RAD2DEG
+    _td_att.pitch = msg.pitch * _RAD2DEG
+    _td_att.yaw = msg.yaw * _RAD2DEG
+
+def _h_sys(msg):
+    _td_bat.voltage = msg.voltage_battery / 1000.0
+    _td_bat.current = msg.current_battery / 100.0
+    _td_bat.remaining = msg.battery_remaining
+
+def _h_gps(msg):
+    _td_gps.fix_type = msg.fix_type
+    _td_gps.satellites_visible = msg.satellites_visible
+
+def _h_hb(msg):
+    telemetry_data.armed = (msg.base_mode & _ARMED_FLAG) != 0
+    telemetry_data.mode = _mode_str(msg)
+
+# Keyed on the message's _type attribute, which is what get_type() returns,
+# so each message costs one dict lookup with no method call
+_DISPATCH = {
+    "GLOBAL_POSITION_INT": _h_gpi,
+    "ATTITUDE": _h_att,
+    "SYS_STATUS": _h_sys,
+    "GPS_RAW_INT": _h_gps,
+    "HEARTBEAT": _h_hb,
+}
+
+def _enqueue_message(queue: asyncio.Queue, msg):
+    try:
+        queue.put_nowait(msg)
+    except asyncio.QueueFull:
+        pass # Reader task is behind; drop this message, newer ones will follow
+
+def _mavlink_reader_thread(loop: asyncio.AbstractEventLoop, queue: asyncio.Queue):
+    """
+    Blocks on the MAVLink connection in its own thread so the event loop never has to,
+    and hands each message to the loop without going through an executor.
+    """
+    while not mav_reader_stop.is_set():
+        try:
+            msg = mav_connection.recv_match(blocking=True, timeout=1.0)
+        except Exception as e:
+            logging.error("Error in MAVLink reader thread: %s", e)
+            # Avoid hammering the log in case of rapid errors
+            mav_reader_stop.wait(2)
+            continue
+        if msg:
+            loop.call_soon_threadsafe(_enqueue_message, queue, msg)
+
+def _on_mavlink_readable():
+    """
+    Called by the event loop when the MAVLink UDP socket is readable.
+    Drains up to MAVLINK_READ_BATCH datagrams and applies every message they decode to.
+    """
+    dispatch = _DISPATCH.get
+    updated = False
+    for _ in range(MAVLINK_READ_BATCH):
+        try:
+            data = mav_connection.recv() # also records the sender so commands can be sent back
+            if not data:
+                break # socket drained
+            if mav_connection.first_byte:
+                mav_connection.auto_mavlink_version(data)
+            msgs = mav_connection.mav.parse_buffer(data) # every message in the datagram in one call
+        except Exception as e:
+            logging.error("Error in MAVLink reader: %s", e)
+            break
+        if not msgs:
+            continue
+        for msg in msgs:
+            mav_connection.post_message(msg) # keep pymavlink's per-connection state current
+            handler = dispatch(msg._type)
+            if handler is not None:
+                handler(msg)
+                updated = True
+    if updated:
+        # Flag the update for the next broadcast
+        _mark_dirty()
+
 async def read_and_broadcast_mavlink():
     """
     The core background task that reads messages from the drone
     and broadcasts them to connected clients.
     """
-    global telemetry_data
-    loop = asyncio.get_event_loop()
-
+    global mav_reader_fd
+    loop = asyncio.get_running_loop()
+    if isinstance(mav_connection, mavutil.mavudp):
+        # pymavlink's UDP socket is already non-blocking, so the event loop can watch it
+        # directly and drain several datagrams per wakeup; no thread or queue hop needed
+        fd = mav_connection.port.fileno()
+        try:
+            loop.add_reader(fd, _on_mavlink_readable)
+        except NotImplementedError:
+            pass # e.g. the Proactor loop on Windows can't watch sockets; use the thread below
+        else:
+            mav_reader_fd = fd
+            return
+
+    # Serial and other links only offer a blocking read, so use a dedicated thread
+    queue = asyncio.Queue(maxsize=1024)
+    threading.Thread(target=_mavlink_reader_thread, args=(loop, queue), name="mavlink-reader", daemon=True).start()
+
+    dispatch = _DISPATCH.get
     while True:
         try:
-            # Use run_in_executor to avoid blocking the asyncio event loop
-            msg = await loop.run_in_executor(
-                None, lambda: mav_connection.recv_match(blocking=True, timeout=1.0)
-            )
-
-            if not msg:
-                # Timeout, continue to next iteration
-                continue
-
-            msg_type = msg.get_type()
-            updated = False
-
-            if msg_type == "GLOBAL_POSITION_INT":
-                telemetry_data["location"]["lat"] = msg.lat / 1e7
-                telemetry_data["location"]["lon"] = msg.lon / 1e7
-                telemetry_data["location"]["alt"] = msg.relative_alt / 1000.0 # More common to use relative alt
-                updated = True
-            
-            elif msg_type == "ATTITUDE":
-                telemetry_data["attitude"]["roll"] = math.degrees(msg.roll)
-                telemetry_data["attitude"]["pitch"] = math.degrees(msg.pitch)
-                telemetry_data["attitude"]["yaw"] = math.degrees(msg.yaw)
-                updated = True
-
-            elif msg_type == "SYS_STATUS":
-                telemetry_data["battery"]["voltage"] = msg.voltage_battery / 1000.0
-                telemetry_data["battery"]["current"] = msg.current_battery / 100.0
-                telemetry_data["battery"]["remaining"] = msg.battery_remaining
-                updated = True
-
-            elif msg_type == "GPS_RAW_INT":
-                telemetry_data["gps_status"]["fix_type"] = msg.fix_type
-                telemetry_data["gps_status"]["satellites_visible"] = msg.satellites_visible
-                updated = True
-            
-            elif msg_type == "HEARTBEAT":
-                telemetry_data["armed"] = (msg.base_mode & mavutil.mavlink.MAV_MODE_FLAG_SAFETY_ARMED) != 0
-                telemetry_data["mode"] = mavutil.mode_string_v10(msg)
-                updated = True
+            msg = await queue.get()
 
-            # If any data was updated, broadcast the new state
-            if updated:
-                await manager.broadcast_json(telemetry_data)
+            handler = dispatch(msg._type)
+            if handler is not None:
+                handler(msg)
+                # Flag the update for the next broadcast
+                _mark_dirty()
 
         except Exception as e:
-            logging.error(f"Error in MAVLink reader task: {e}")
+            logging.error("Error in MAVLink reader task: %s", e)
             # Avoid hammering the log in case of rapid errors
             await asyncio.sleep(2)
 
+# --- Broadcast Task ---
+async def flush_telemetry():
+    """
+    Publishes and broadcasts telemetry_data once per BROADCAST_INTERVAL if anything
+    changed, so a burst of MAVLink messages goes out as a single frame.
+    """
+    global _dirty, _snapshot
+    while True:
+        await asyncio.sleep(BROADCAST_INTERVAL)
+        if _dirty:
+            _dirty = False
+            _snapshot = snapshot = _encode_snapshot()
+            await manager.broadcast_message(snapshot[1])
+
 # --- Application Lifecycle Events ---
+# Strong references to the startup tasks, so they can't be garbage collected mid-run
+# and a crash is logged as it happens rather than as "Task exception was never retrieved"
+background_tasks = set()
+
+def _on_background_task_done(task: asyncio.Task):
+    background_tasks.discard(task)
+    if not task.cancelled() and task.exception() is not None:
+        logging.error("Background task %s failed", task.get_name(), exc_info=task.exception())
+
+def _start_background_task(coro):
+    task = asyncio.create_task(coro)
+    background_tasks.add(task)
+    task.add_done_callback(_on_background_task_done)
+
 @app.on_event("startup")
 async def startup_event():
     """Tasks to run when the application starts."""
+    _start_background_task(flush_telemetry())
     if USE_DUMMY_DATA:
         # Start the dummy data generator
-        asyncio.create_task(generate_and_broadcast_dummy_data())
+        _start_background_task(generate_and_broadcast_dummy_data())
     else:
         # Connect to the real MAVLink source and start the reader
         connect_to_mavlink()
-        asyncio.create_task(read_and_broadcast_mavlink())
+        _start_background_task(read_and_broadcast_mavlink())
 
 @app.on_event("shutdown")
 async def shutdown_event():
@@ -247,6 +436,9 @@ async def shutdown_event():
             await connection.close(code=1000)
         except Exception:
             pass # Ignore errors on close
+    mav_reader_stop.set()
+    if mav_reader_fd is not None:
+        asyncio.get_running_loop().remove_reader(mav_reader_fd)
     if mav_connection:
         mav_connection.close()
     logging.info("Shutdown complete.")
@@ -254,5 +446,18 @@ async def shutdown_event():
 
 if __name__ == "__main__":
     # To run: uvicorn drone_api:app --host 0.0.0.0 --port 8000 --reload
-    uvicorn.run(app, host="0.0.0.0", port=8000)
+    # uvicorn's "auto" loop/http/ws settings pick uvloop, httptools and websockets when they're
+    # installed (pip install -r requirements.txt) and fall back to the stdlib otherwise.
+    # Keep workers=1: telemetry_data and the client list live in this process, so scaling out
+    # across processes would need an external pub/sub to share them.
+    uvicorn.run(
+        app,
+        host="0.0.0.0",
+        port=8000,
+        # Every client gets the same frame, so compressing it per connection is wasted work
+        ws_per_message_deflate=False,
+        access_log=False,
+        log_level="warning",
+        workers=1,
+    )
 